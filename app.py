@@ -24,6 +24,8 @@ bot_image = (
         "llama-index-vector-stores-chroma",
         "websocket-client",
         "aiofiles",
+        "httpx[http2]",
+        "orjson",
         "fastapi[standard]",
         "huggingface_hub[hf_transfer]",
     )
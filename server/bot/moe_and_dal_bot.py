@@ -1,3 +1,5 @@
+import asyncio
+import os
 import sys
 from loguru import logger
 
@@ -35,7 +37,7 @@ import modal
 
 try:
     logger.remove(0)
-    logger.add(sys.stderr, level="DEBUG")
+    logger.add(sys.stderr, level=os.environ.get("LOG_LEVEL", "INFO"))
 except ValueError:
     # Handle the case where logger is already initialized
     pass
@@ -87,20 +89,37 @@ async def run_bot(
         params=transport_params,
     )
 
-    stt = ModalParakeetSegmentedSTTService(
-        modal_tunnel_manager=ModalTunnelManager(
-            app_name="parakeet-transcription",
-            cls_name="Transcriber",
-        ),
+    stt_tunnel_manager = ModalTunnelManager(
+        app_name="parakeet-transcription",
+        cls_name="Transcriber",
     )
-
-    modal_rag = ModalRag(chroma_db=chroma_db, similarity_top_k=3, num_adjacent_nodes=2)
-
     modal_sglang_tunnel_manager = ModalTunnelManager(
         app_name="sglang-server",
         cls_name="SGLangServer",
     )
-    base_url = await modal_sglang_tunnel_manager.get_url()
+    # one kokoro tunnel per speaker
+    tts_tunnel_managers = [
+        ModalTunnelManager(
+            app_name="kokoro-tts",
+            cls_name="KokoroTTS",
+        )
+        for _ in range(2 if enable_moe_and_dal else 1)
+    ]
+
+    # the services cold start independently, so wait on all of their tunnels at once
+    # instead of one after another as each service connects
+    stt_url, base_url, *tts_urls = await asyncio.gather(
+        stt_tunnel_manager.resolve_url(),
+        modal_sglang_tunnel_manager.resolve_url(),
+        *(tunnel_manager.resolve_url() for tunnel_manager in tts_tunnel_managers),
+    )
+
+    stt = ModalParakeetSegmentedSTTService(
+        modal_tunnel_manager=stt_tunnel_manager,
+        websocket_url=stt_url,
+    )
+
+    modal_rag = ModalRag(chroma_db=chroma_db, similarity_top_k=3, num_adjacent_nodes=2)
 
     llm = ModalOpenAILLMService(
         model="Qwen/Qwen3-4B-Instruct-2507",
@@ -149,19 +168,15 @@ async def run_bot(
     if enable_moe_and_dal:
         ta = MoeDalBotAnimation()
         moe_tts = ModalKokoroTTSService(
-            modal_tunnel_manager=ModalTunnelManager(
-                app_name="kokoro-tts",
-                cls_name="KokoroTTS",
-            ),
+            modal_tunnel_manager=tts_tunnel_managers[0],
+            websocket_url=tts_urls[0],
             speaker="moe",
             voice="am_puck",
             speed=1.3,
         )
         dal_tts = ModalKokoroTTSService(
-            modal_tunnel_manager=ModalTunnelManager(
-                app_name="kokoro-tts",
-                cls_name="KokoroTTS",
-            ),
+            modal_tunnel_manager=tts_tunnel_managers[1],
+            websocket_url=tts_urls[1],
             speaker="dal",
             voice="am_fenrir",
             speed=1.5,
@@ -177,10 +192,8 @@ async def run_bot(
         ]
     else:
         processors.append(ModalKokoroTTSService(
-            modal_tunnel_manager=ModalTunnelManager(
-                app_name="kokoro-tts",
-                cls_name="KokoroTTS",
-            ),
+            modal_tunnel_manager=tts_tunnel_managers[0],
+            websocket_url=tts_urls[0],
             voice="am_puck",
             speed=1.35,
         ))
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from loguru import logger
 
@@ -166,19 +167,15 @@ class ModalRag(FrameProcessor):
         await self.push_frame(frame, direction) 
 
 
-def get_system_prompt(enable_moe_and_dal: bool = False):
-    """Get the system prompt for the Modal RAG."""
-    system_prompt = "You are a conversational AI that is an expert in the Modal library."
+_SYSTEM_PROMPT_INTRO = "You are a conversational AI that is an expert in the Modal library."
 
-    # add moe and dal instructions if enabled
-    if enable_moe_and_dal:
-        system_prompt += \
+_MOE_AND_DAL_INSTRUCTIONS = \
 """
 Your form is the Modal logo, a pair of characters named Moe and Dal. 
 Always refer to yourself as "Moe and Dal" and refer to yourself in the plural using words such as 'we' and 'us' and never 'I' or 'me'.
 """
 
-    system_prompt += """
+_SYSTEM_PROMPT_BODY = """
 Your job is to provide useful information about Modal and developing with Modal to the user.
 Potentially relevant sections of Modal's documentation will be provided to you as context in the user's most.
 
@@ -354,4 +351,33 @@ You MUST respond with ONLY the following JSON format (no additional text):
     "links": list[str], List of relevant URLs. These must be valid URLs pulled directly from the documentation context. If the URL path is relative, use the prefix https://modal.com/docs.
 }}
 """
-    return system_prompt
\ No newline at end of file
+
+# the retrieved docs and the JSON format are restated in every user message by ModalRag,
+# so the system prompt only needs enough to answer the first (non-RAG) greeting turn
+_LEAN_SYSTEM_PROMPT_BODY = """
+You help users build and deploy with Modal, the serverless cloud platform for Python.
+Relevant sections of Modal's documentation are added to each user message.
+Respond with ONLY this JSON and no other text:
+{"spoke_response": str, "code_blocks": list[str], "links": list[str]}
+spoke_response is read aloud, so use short, plain sentences with no code, symbols, or formatting.
+code_blocks holds short, relevant code snippets.
+links holds URLs from the provided docs, prefixed with https://modal.com/docs if relative.
+"""
+
+# set SYSTEM_PROMPT_VERSION=full to go back to the long-form prompt with the Modal primer
+_SYSTEM_PROMPT_VERSION = os.environ.get("SYSTEM_PROMPT_VERSION", "lean")
+_SELECTED_SYSTEM_PROMPT_BODY = (
+    _SYSTEM_PROMPT_BODY if _SYSTEM_PROMPT_VERSION == "full" else _LEAN_SYSTEM_PROMPT_BODY
+)
+
+# built once so every session sends a byte-identical system message,
+# which keeps the LLM server's prefix cache hitting across conversations
+_SYSTEM_PROMPT = _SYSTEM_PROMPT_INTRO + _SELECTED_SYSTEM_PROMPT_BODY
+_MOE_AND_DAL_SYSTEM_PROMPT = _SYSTEM_PROMPT_INTRO + _MOE_AND_DAL_INSTRUCTIONS + _SELECTED_SYSTEM_PROMPT_BODY
+
+
+def get_system_prompt(enable_moe_and_dal: bool = False):
+    """Get the system prompt for the Modal RAG."""
+    if enable_moe_and_dal:
+        return _MOE_AND_DAL_SYSTEM_PROMPT
+    return _SYSTEM_PROMPT
\ No newline at end of file
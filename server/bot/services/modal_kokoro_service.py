@@ -1,8 +1,9 @@
 import traceback
 from typing import AsyncGenerator
 from loguru import logger
-import json
+import orjson
 import re
+import os
 import sys
 
 from pipecat.frames.frames import (
@@ -20,7 +21,7 @@ from server.bot.processors.unison_speaker_mixer import TTSSpeakerAudioRawFrame
 
 try:
     logger.remove(0)
-    logger.add(sys.stderr, level="DEBUG")
+    logger.add(sys.stderr, level=os.environ.get("LOG_LEVEL", "INFO"))
 except ValueError:
     # Handle the case where logger is already initialized
     pass
@@ -44,6 +45,15 @@ class ModalKokoroTTSService(ModalWebsocketTTSService):
         self._speed = speed
         self._running = False
 
+        # everything but the text is fixed for the session, so serialize it once
+        # and only splice the escaped prompt text in per utterance
+        self._prompt_prefix = orjson.dumps({
+            "type": "prompt",
+            "voice": self._voice,
+            "speed": self._speed,
+        })[:-1] + b',"text":'
+        self._prompt_suffix = b"}"
+
     def can_generate_metrics(self) -> bool:
         """Indicate that this service can generate usage metrics."""
         return True
@@ -65,6 +75,9 @@ class ModalKokoroTTSService(ModalWebsocketTTSService):
         """Receive and process messages from WebSocket.
         """
         async for message in self._get_websocket():
+            if not isinstance(message, bytes):
+                logger.warning(f"Received non-binary message: {type(message)}")
+                continue
             try:
                 await self.stop_ttfb_metrics()
 
@@ -72,7 +85,6 @@ class ModalKokoroTTSService(ModalWebsocketTTSService):
                     await self.push_frame(TTSSpeakerAudioRawFrame(message, self.sample_rate, 1, speaker=self._speaker))
                 else:
                     await self.push_frame(TTSAudioRawFrame(message, self.sample_rate, 1))
-                logger.info(f"Received audio data of length {len(message)} bytes")
             except Exception as e:
                 logger.error(f"Error decoding audio: {e}:{traceback.format_exc()}")
                 await self.push_error(ErrorFrame(f"Error decoding audio: {e}"))
@@ -101,14 +113,9 @@ class ModalKokoroTTSService(ModalWebsocketTTSService):
             prompt = re.sub(r'\bDal\b', _DAL_PHONETIC_TEXT, prompt)
             prompt = re.sub(r'\bdal\b', _DAL_PHONETIC_TEXT, prompt)
 
-            tts_msg = {
-                "type": "prompt",
-                "text": prompt.strip(),
-                "voice": self._voice,
-                "speed": self._speed,
-            }
-            logger.info(f"Sending prompt: {tts_msg}")
-            await self._websocket.send(json.dumps(tts_msg))
+            tts_msg = self._prompt_prefix + orjson.dumps(prompt.strip()) + self._prompt_suffix
+            logger.opt(lazy=True).debug("Sending prompt: {}", lambda: tts_msg)
+            await self._websocket.send(tts_msg)
         except Exception as e:
             logger.error(f"Failed to send audio to KokoroTTS: {e}")
             yield ErrorFrame(f"Failed to send audio to KokoroTTS:  {e}")
@@ -1,9 +1,11 @@
 from loguru import logger
+import os
 import sys
 import uuid
 import asyncio
 import time
-from openai import AsyncStream
+import httpx
+from openai import AsyncOpenAI, AsyncStream, DefaultAsyncHttpxClient
 from openai.types.chat import ChatCompletionChunk
 
 from pipecat.frames.frames import StopFrame, CancelFrame
@@ -17,7 +19,7 @@ import modal
 
 try:
     logger.remove(0)
-    logger.add(sys.stderr, level="DEBUG")
+    logger.add(sys.stderr, level=os.environ.get("LOG_LEVEL", "INFO"))
 except ValueError:
     # Handle the case where logger is already initialized
     pass
@@ -49,6 +51,30 @@ class ModalOpenAILLMService(OpenAILLMService):
     
         # Create the JSON parser instance
         self.json_parser = ModalRagStreamingJsonParser(self)
+
+    def create_client(
+        self,
+        api_key=None,
+        base_url=None,
+        organization=None,
+        project=None,
+        default_headers=None,
+        **kwargs,
+    ):
+        # keep one HTTP/2 channel open through the Modal tunnel for the whole session
+        # so each turn streams without paying a new TCP + TLS handshake
+        return AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            organization=organization,
+            project=project,
+            http_client=DefaultAsyncHttpxClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=300),
+                timeout=httpx.Timeout(60.0, connect=5.0),
+            ),
+            default_headers=default_headers,
+        )
         
 
     async def stop(self, frame: StopFrame):
@@ -62,6 +88,8 @@ class ModalOpenAILLMService(OpenAILLMService):
     async def _cleanup(self):
         if self.modal_tunnel_manager:
             await self.modal_tunnel_manager.close()
+            # stop and cancel both land here, only release the tunnel once
+            self.modal_tunnel_manager = None
 
     @traced_llm
     async def _process_context(self, context: OpenAILLMContext):
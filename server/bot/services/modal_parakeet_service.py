@@ -1,7 +1,7 @@
-import json
+import orjson
 from typing import AsyncGenerator
 from loguru import logger
-import base64
+import os
 import sys
 
 from pipecat.frames.frames import (
@@ -18,11 +18,17 @@ from .modal_services import ModalWebsocketSegmentedSTTService
 
 try:
     logger.remove(0)
-    logger.add(sys.stderr, level="DEBUG")
+    logger.add(sys.stderr, level=os.environ.get("LOG_LEVEL", "INFO"))
 except ValueError:
     # Handle the case where logger is already initialized
     pass
 
+# control frames never change, serialize them once
+_VAD_OFF_MSG = orjson.dumps({
+    "type": "set_vad",
+    "vad": False
+}).decode()
+
 class ModalParakeetSegmentedSTTService(ModalWebsocketSegmentedSTTService):
     def __init__(
         self, 
@@ -38,11 +44,7 @@ class ModalParakeetSegmentedSTTService(ModalWebsocketSegmentedSTTService):
         """
         await super().start(frame)
         # turn off vad
-        vad_msg = {
-            "type": "set_vad",
-            "vad": False
-        }
-        await self._websocket.send(json.dumps(vad_msg))
+        await self._websocket.send(_VAD_OFF_MSG)
 
     async def _receive_messages(self):
         """Receive and process messages from WebSocket.
@@ -67,11 +69,8 @@ class ModalParakeetSegmentedSTTService(ModalWebsocketSegmentedSTTService):
             return
         await self.start_ttfb_metrics()
         try:
-            audio_msg = {
-                "type": "audio",
-                "audio": base64.b64encode(audio).decode("utf-8")
-            }
-            await self._websocket.send(json.dumps(audio_msg))
+            # send raw PCM as a binary frame, the server reads it with np.frombuffer
+            await self._websocket.send(audio)
         except Exception as e:
             logger.error(f"Failed to send audio to Parakeet: {e}")
             yield ErrorFrame(f"Failed to send audio to Parakeet:  {e}")
@@ -2,6 +2,7 @@ from loguru import logger
 import uuid
 import asyncio
 from typing import Optional
+import os
 import sys
 
 from websockets.asyncio.client import connect as websocket_connect
@@ -24,7 +25,7 @@ import modal
 
 try:
     logger.remove(0)
-    logger.add(sys.stderr, level="DEBUG")
+    logger.add(sys.stderr, level=os.environ.get("LOG_LEVEL", "INFO"))
 except ValueError:
     # Handle the case where logger is already initialized
     pass
@@ -45,6 +46,7 @@ class ModalTunnelManager:
 
         self._modal_dict_id = None
         self._url_dict = None
+        self._url = None
         self.function_call = None
         
         self._cls = modal.Cls.from_name(app_name, cls_name)(**self._cls_kwargs)
@@ -75,6 +77,12 @@ class ModalTunnelManager:
                 self._spawn_service(d)
                 return await self._get_url_from_dict(d)
 
+    async def resolve_url(self):
+        """Get the service URL once and reuse it on later calls."""
+        if self._url is None:
+            self._url = await self.get_url()
+        return self._url
+
     async def close(self):
         if self._lazy_spawn:
             try:
@@ -169,6 +177,8 @@ class ModalWebsocketService(WebsocketService):
         finally:
             if self.modal_tunnel_manager:
                 await self.modal_tunnel_manager.close()
+                # stop and cancel both disconnect, only release the tunnel once
+                self.modal_tunnel_manager = None
 
     async def _connect_websocket(self):
         """Establish WebSocket connection to API."""
@@ -178,6 +188,8 @@ class ModalWebsocketService(WebsocketService):
                 return
             self._websocket = await websocket_connect(
                 self._websocket_url,
+                compression=None,
+                max_size=16 * 1024 * 1024,
             )
             logger.debug("Connected to Modal Websocket")
         except Exception as e:
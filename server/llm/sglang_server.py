@@ -164,6 +164,8 @@ class SGLangServer:
 
     @modal.enter(snap=False)
     async def restore(self):
+        self._shutdown = asyncio.Event()
+
         print("moving back to gpu...")
         url = f"http://127.0.0.1:{SGLANG_PORT}/resume_memory_occupation"
         headers = {"Content-Type": "application/json"}
@@ -177,13 +179,19 @@ class SGLangServer:
         self.tunnel = await self.tunnel_ctx.__aenter__()
         print(f"SGLANG URL: {self.tunnel.url}")
 
+    @modal.exit()
+    async def exit(self):
+        # enter(snap=False) may have failed before creating these, don't mask its error
+        if hasattr(self, "_shutdown"):
+            self._shutdown.set()
+        if getattr(self, "tunnel_ctx", None):
+            await self.tunnel_ctx.__aexit__(None, None, None)
+            self.tunnel_ctx = None
+            self.tunnel = None
+
     def _warmup(self) -> None:
         """Send a few warmup requests to the server."""
-        import base64
-        import io
-
         from openai import OpenAI
-        from PIL import Image
 
         print("🚀 Warming up server...")
 
@@ -230,7 +238,12 @@ class SGLangServer:
             print("Tunnel client is running. Waiting for it to finish.")
             
             while await d.get.aio("is_running"):
-                await asyncio.sleep(1.0)
+                try:
+                    # returns as soon as the container exits instead of on the next poll
+                    await asyncio.wait_for(self._shutdown.wait(), timeout=1.0)
+                    break
+                except asyncio.TimeoutError:
+                    pass
 
             print("Tunnel client finished.")
 
@@ -1,6 +1,6 @@
+import json
 import time
 import asyncio
-import uuid
 import modal
 
 from server import SERVICE_REGIONS
@@ -11,13 +11,14 @@ vllm_image = (
         "vllm==0.10.1.1",
         "huggingface_hub[hf_transfer]==0.34",
         "flashinfer-python==0.2.14.post1",
-        "accelerate",
         extra_index_url="https://download.pytorch.org/whl/cu128",
         extra_options="--index-strategy unsafe-best-match",
     )
     .env({
         "HF_HUB_ENABLE_HF_TRANSFER": "1",
         "VLLM_USE_V1": "1",
+        # pin attention to flashinfer (installed above) rather than the per-version default
+        "VLLM_ATTENTION_BACKEND": "FLASHINFER",
         "VERBOSE": "DEBUG",
         # "TORCHINDUCTOR_FX_GRAPH_CACHE": "1",
         # "CUDA_CACHE_PATH": "/root/.cache/.vllm/.nv_cache",
@@ -30,6 +31,8 @@ vllm_image = (
 )
 
 MODEL_NAME = "Qwen/Qwen3-4B-Instruct-2507"
+# official FP8 weights of MODEL_NAME, served under the original name so clients don't change
+QUANTIZED_MODEL_NAME = "Qwen/Qwen3-4B-Instruct-2507-FP8"
 
 # hf_cache_vol = modal.Volume.from_name("voice-bot-hf-cache-vf2", create_if_missing=True)
 # vllm_cache_vol = modal.Volume.from_name("voice-bot-vllm-cache-vf2", create_if_missing=True)
@@ -40,11 +43,24 @@ FAST_BOOT = False
 app = modal.App("vllm-service")
 
 N_GPU = 1
+MAX_NUM_SEQS = 1
 MINUTES = 60  # seconds
 VLLM_PORT = 8000
 
 with vllm_image.imports():
     import requests
+    import threading
+    import uvicorn
+    import uvloop
+    from vllm.engine.arg_utils import AsyncEngineArgs
+    from vllm.entrypoints.openai.api_server import (
+        build_app,
+        build_async_engine_client_from_engine_args,
+        init_app_state,
+    )
+    from vllm.entrypoints.openai.cli_args import make_arg_parser, validate_parsed_serve_args
+    from vllm.utils import FlexibleArgumentParser, set_ulimit
+    import vllm.envs as vllm_envs
 
 @app.cls(
     image=vllm_image,
@@ -67,19 +83,17 @@ class VLLMServer():
 
     @modal.enter(snap=True)
     async def launch_vllm_server(self):
-        import subprocess
-        import requests
 
         self.tunnel_ctx = None
         self.tunnel = None
         self.vllm_url = None
+        self._shutdown = asyncio.Event()
 
 
-        cmd = [
-            "vllm",
-            "serve",
+        cli_args = [
             "--uvicorn-log-level=info",
-            MODEL_NAME,
+            "--model",
+            QUANTIZED_MODEL_NAME,
             "--served-model-name",
             MODEL_NAME,
             "llm",
@@ -89,38 +103,60 @@ class VLLMServer():
             str(VLLM_PORT),
             "--enable-chunked-prefill",
             "--max-num-seqs",
-            "1",
+            str(MAX_NUM_SEQS),
             "--max-model-len",
             "16384",
             "--enable-prefix-caching",
             "--gpu-memory-utilization",
             "0.25",
+            # fp8 weights and kv cache run on the H100's native fp8 tensor cores and
+            # halve their footprint, leaving more of the memory budget for kv blocks
+            "--kv-cache-dtype",
+            "fp8",
             
         ]
 
         # enforce-eager disables both Torch compilation and CUDA graph capture
         # default is no-enforce-eager. see the --compilation-config flag for tighter control
-        cmd += ["--enforce-eager" if FAST_BOOT else "--no-enforce-eager"]
+        cli_args += ["--enforce-eager" if FAST_BOOT else "--no-enforce-eager"]
+        # only capture decode graphs for batch sizes the scheduler can actually produce.
+        # --cuda-graph-sizes with a single value expands to [1, 2, 4, 8, 16, ...] up to
+        # it, so the exact list has to go through the compilation config instead
+        cli_args += ["--compilation-config", json.dumps({
+            "cudagraph_capture_sizes": [size for size in (1, 2, 4, 8) if size <= MAX_NUM_SEQS],
+        })]
 
         # assume multiple GPUs are for splitting up large matrix multiplications
-        cmd += ["--tensor-parallel-size", str(N_GPU)]
+        cli_args += ["--tensor-parallel-size", str(N_GPU)]
 
-        print(cmd)
+        print(cli_args)
 
-        subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1,
-        )
+        # same flags as `vllm serve`, but the engine and its OpenAI server live in
+        # this process instead of a subprocess we have to poll for health
+        parser = make_arg_parser(FlexibleArgumentParser())
+        args = parser.parse_args(cli_args)
+        validate_parsed_serve_args(args)
 
+        # run_server would do this, raise the open file limit for many concurrent streams
+        set_ulimit()
 
-        self.wait_for_server()
+        self._server_ready = threading.Event()
+        self._server_error = None
+        self.server_thread = threading.Thread(
+            target=lambda: uvloop.run(self._serve(args)), daemon=True
+        )
+        self.server_thread.start()
+
+        # wait off the event loop, this hook is async
+        if not await asyncio.to_thread(self._server_ready.wait, 20 * MINUTES):
+            raise TimeoutError("VLLM server failed to start within timeout period")
+        if self._server_error is not None:
+            raise RuntimeError(f"VLLM server failed to start: {self._server_error}")
+        print("VLLM server is ready!")
 
         for _ in range(4):
             start_time = time.perf_counter()
-            self.ping(url_type = "local")
+            await asyncio.to_thread(self.ping, url_type = "local")
             end_time = time.perf_counter()
             print(f"Time taken: {end_time - start_time} seconds")
 
@@ -128,50 +164,53 @@ class VLLMServer():
         # hf_cache_vol.commit()
 
 
-    def wait_for_server(self, timeout=60 * 20):
-        """Wait for the VLLM server to be ready"""
-        start_time = time.time()
-        count = 0
-        while time.time() - start_time < timeout:
-            try:
-                if self.healthcheck():
-                    print("VLLM server is ready!")
-                    return
-                count += 1
-            except Exception:
-                pass
-            if count % 10 == 0:
-                print("VLLM server NOT ready!")
-            time.sleep(1)
-        raise TimeoutError("VLLM server failed to start within timeout period")
-
-    def healthcheck(self):
-        """
-        Perform a healthcheck on the VLLM server
-        Returns True if healthy, False otherwise
+    async def _serve(self, args):
+        """Build the engine and serve the OpenAI-compatible app on the thread's event loop.
+
+        Follows vLLM's run_server/serve_http, which can't be called as is because they
+        install signal handlers and those only work on the main thread. Shutdown is left
+        to the container lifecycle instead. --root-path is applied by build_app.
         """
         try:
-            response = requests.get("http://localhost:8000/health", timeout=5)
-            return response.status_code == 200
-        except requests.exceptions.RequestException:
-            return False
-
-    # @modal.enter(snap=False)
-    # async def setup_tunnel(self):
-        
-    #     # vllm_cache_vol.reload()
-    #     # hf_cache_vol.reload()
+            engine_args = AsyncEngineArgs.from_cli_args(args)
+            async with build_async_engine_client_from_engine_args(engine_args) as engine_client:
+                web_app = build_app(args)
+                vllm_config = await engine_client.get_vllm_config()
+                await init_app_state(engine_client, vllm_config, web_app.state, args)
 
-    #     self.tunnel_ctx = modal.forward(VLLM_PORT)
-    #     self.tunnel = await self.tunnel_ctx.__aenter__()
-    #     self.vllm_url = self.tunnel.url
-    #     print(f"vLLM URL: {self.vllm_url}")
+                server = uvicorn.Server(
+                    uvicorn.Config(
+                        web_app,
+                        host=args.host,
+                        port=args.port,
+                        log_level=args.uvicorn_log_level,
+                        access_log=not args.disable_uvicorn_access_log,
+                        timeout_keep_alive=vllm_envs.VLLM_HTTP_TIMEOUT_KEEP_ALIVE,
+                        ssl_keyfile=args.ssl_keyfile,
+                        ssl_certfile=args.ssl_certfile,
+                        ssl_ca_certs=args.ssl_ca_certs,
+                        ssl_cert_reqs=args.ssl_cert_reqs,
+                        http="httptools",
+                    )
+                )
+                serve_task = asyncio.create_task(server.serve())
+                while not server.started and not serve_task.done():
+                    await asyncio.sleep(0.010)
+                self._server_ready.set()
+                await serve_task
+        except Exception as e:
+            self._server_error = e
+            raise
+        finally:
+            self._server_ready.set()
 
-    #     for _ in range(4):
-    #         start_time = time.perf_counter()
-    #         self.ping()
-    #         end_time = time.perf_counter()
-    #         print(f"Time taken: {end_time - start_time} seconds")
+    @modal.enter(snap=False)
+    async def setup_tunnel(self):
+        # tunnels can't be snapshotted, open one per restored container
+        self.tunnel_ctx = modal.forward(VLLM_PORT)
+        self.tunnel = await self.tunnel_ctx.__aenter__()
+        self.vllm_url = self.tunnel.url
+        print(f"vLLM URL: {self.vllm_url}")
 
     # @modal.method()
     def ping(self, url_type: str = "local"):
@@ -197,7 +236,10 @@ class VLLMServer():
 
     @modal.exit()
     async def exit(self):
-        if self.tunnel_ctx:
+        # the enter hook may have failed before creating these, don't mask its error
+        if hasattr(self, "_shutdown"):
+            self._shutdown.set()
+        if getattr(self, "tunnel_ctx", None):
             await self.tunnel_ctx.__aexit__(None, None, None)
             self.tunnel_ctx = None
             self.tunnel = None
@@ -206,11 +248,23 @@ class VLLMServer():
     @modal.method()
     async def run_tunnel_client(self, d: modal.Dict):
         try:
-            print(f"Sending websocket url: {self.websocket_url}")
-            await d.put.aio("url", self.websocket_url)
+            print(f"Sending vLLM url: {self.vllm_url}")
+            await d.put.aio("url", self.vllm_url)
             
-            while True:
-                asyncio.sleep(1.0)
+            while not await d.contains.aio("is_running"):
+                await asyncio.sleep(1.0)
+
+            print("Tunnel client is running. Waiting for it to finish.")
+
+            while await d.get.aio("is_running"):
+                try:
+                    # returns as soon as the container exits instead of on the next poll
+                    await asyncio.wait_for(self._shutdown.wait(), timeout=1.0)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+
+            print("Tunnel client finished.")
 
         except Exception as e:
             print(f"Error running tunnel client: {type(e)}: {e}")
@@ -222,9 +276,8 @@ if __name__ == "__main__":
     for _ in range(num_cold_starts):
         start_time = time.time()
         with modal.Dict.ephemeral() as d:
-            client_id = str(uuid.uuid4())
-            d.put(client_id, True)
-            call_id = vllm_server().run_tunnel_client.spawn(d, client_id)
+            d.put("is_running", True)
+            call_id = vllm_server().run_tunnel_client.spawn(d)
             while not d.contains("url"):
                 time.sleep(0.100)
             vllm_url = d.get("url")
@@ -1,9 +1,5 @@
 import asyncio
-import os
-import sys
 import time
-import json
-import base64
 
 import modal
 
@@ -39,6 +35,10 @@ image = (
         "torchaudio",
         "soundfile",
         "uvicorn[standard]",
+        "numba",
+        "orjson",
+        "uvloop",
+        "httptools",
     )
     .entrypoint([])  # silence chatty logs by container on start
 )
@@ -47,27 +47,32 @@ SAMPLE_RATE = 16000
 MIN_AUDIO_SEGMENT_DURATION_SAMPLES = int(SAMPLE_RATE / 2)
 VAD_CHUNK_SIZE = 512
 UVICORN_PORT = 8000
+WS_MAX_SIZE = 16 * 1024 * 1024
+# segments from concurrent streams that arrive within the window are transcribed together
+MAX_TRANSCRIBE_BATCH = 8
+TRANSCRIBE_BATCH_WINDOW_S = 0.010
+# the automatic collector is off while serving, the batch worker collects once the
+# queue has been empty this long
+GC_IDLE_S = 0.5
+# segment lengths the dynamic-shape encoder is compiled and warmed on before the snapshot
+WARMUP_AUDIO_SAMPLES = [int(SAMPLE_RATE * seconds) for seconds in (0.5, 1, 2, 4, 8)]
 
 def chunk_audio(data: bytes, chunk_size: int):
     for i in range(0, len(data), chunk_size):
         yield data[i : i + chunk_size]
 
-def int2float(audio_data):
-    abs_max = np.abs(audio_data).max()
-    audio_data = audio_data.astype('float32')
-    if abs_max > 0:
-        audio_data *= 1/32768
-    audio_data = audio_data.squeeze()  # depends on the use case
-    return audio_data
-
 def _bytes_to_torch(data):
     data = np.frombuffer(data, dtype=np.int16)
-    data = torch.from_numpy(int2float(data))
-    return data
+    # the result is held by the batch queue, so it can't reuse a shared buffer
+    audio = np.empty(data.shape[0], dtype=np.float32)
+    _pcm16_to_f32(data, audio)
+    return torch.from_numpy(audio)
 
 with image.imports():
     import numpy as np
     import logging
+    import gc
+    import orjson
     import nemo.collections.asr as nemo_asr
     from fastapi import FastAPI, WebSocket, WebSocketDisconnect
     from starlette.websockets import WebSocketState
@@ -76,6 +81,15 @@ with image.imports():
     import threading
     import uvicorn
     from fastapi import FastAPI
+    import numba
+
+    @numba.njit(cache=True, fastmath=True, nogil=True)
+    def _pcm16_to_f32(src, dst):
+        # single vectorized pass, called once per queued message (a segment, or every
+        # complete VAD window received in one message)
+        scale = np.float32(1 / 32768)
+        for i in range(src.shape[0]):
+            dst[i] = src[i] * scale
 
 
 @app.cls(
@@ -115,11 +129,24 @@ class Transcriber:
             self.model.cfg.decoding.strategy = "greedy_batch"
             self.model.change_decoding_strategy(self.model.cfg.decoding)
 
+        # nothing in this service trains, skip autograd bookkeeping outright.
+        # grad mode is per thread, transcribe_batch still enters inference_mode itself
+        torch.set_grad_enabled(False)
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+
+        # the encoder is nearly all of the FLOPs, compile it to fused GPU kernels.
+        # the warmup below triggers compilation before the snapshot is taken
+        self.model.encoder.compile(dynamic=True)
+
         self.silero_vad, utils = torch.hub.load(
             repo_or_dir='snakers4/silero-vad',
             model='silero_vad',
             force_reload=True
         )
+        # run server-side VAD on the same device as ASR so a speech segment is
+        # copied to the GPU once and used by both models
+        self.silero_vad = self.silero_vad.to("cuda")
         
         (
             self.get_speech_timestamps,
@@ -135,6 +162,9 @@ class Transcriber:
         if audio_bytes.startswith(b"RIFF"):
             audio_bytes = audio_bytes[44:]
         
+        # compile the PCM kernel before the snapshot so it never JITs on a live stream
+        _bytes_to_torch(audio_bytes[:VAD_CHUNK_SIZE * 2])
+
         # Convert raw bytes to int16 numpy array first
         audio_data = np.frombuffer(audio_bytes, dtype=np.int16)
         
@@ -157,12 +187,48 @@ class Transcriber:
         print(f"p50: {np.percentile(times, 50)}")
         print(f"p95: {np.percentile(times, 95)}")
 
+        # compile across short and long segments before the snapshot is taken, both for
+        # a single stream and for a full micro-batch of concurrent streams
+        for num_samples in WARMUP_AUDIO_SAMPLES:
+            for _ in range(3):
+                self.transcribe(torch.zeros(num_samples))
+            for _ in range(2):
+                self.transcribe_batch([torch.zeros(num_samples)] * MAX_TRANSCRIBE_BATCH)
+
+        # first call on the GPU VAD initializes its kernels, don't leave that to the first stream
+        with torch.inference_mode():
+            for _ in range(2):
+                self.silero_vad(torch.zeros(VAD_CHUNK_SIZE, device="cuda"), SAMPLE_RATE)
+            self.silero_vad.reset_states()
+
         print("GPU warmed up")
 
+        # move everything allocated during startup out of the collector's view,
+        # so the collections left to the batch worker only walk per-request objects
+        gc.collect()
+        gc.freeze()
+
     @modal.enter(snap=False)
     def _start_server(self):
 
+        self._shutdown = asyncio.Event()
         self.web_app = FastAPI()
+        self._batch_queue = asyncio.Queue()
+        # set by the first server loop to start, the batch worker runs there
+        self._batch_loop = None
+
+        # avoid collector pauses in the middle of streaming, the batch worker
+        # collects once it has been idle for GC_IDLE_S
+        gc.disable()
+
+        @self.web_app.on_event("startup")
+        async def start_batch_worker():
+            # the app is served both by the tunneled uvicorn and by webapp, keep a single
+            # worker. sessions on either loop submit to it with run_coroutine_threadsafe
+            if self._batch_loop is not None:
+                return
+            self._batch_loop = asyncio.get_running_loop()
+            self._batch_worker_task = asyncio.create_task(self._batch_worker())
 
         @self.web_app.websocket("/ws")
         async def run_with_websocket(ws: WebSocket):
@@ -184,30 +250,34 @@ class Transcriber:
             async def recv_loop(ws, audio_queue):
                 audio_buffer = bytearray()
                 while True:
-                    msg = await ws.receive_text()
-                    try:
-                        json_data = json.loads(msg)
-                        if "type" in json_data:
-                            if json_data["type"] == "start_client_session":
-                                self.run_tunnel_client.spawn(modal.Dict())
-                            if json_data["type"] == "set_vad":
-                                self.use_vad = json_data["vad"]
-                                continue
-                            elif json_data["type"] == "audio":
-                                data = json_data["audio"]
-                                data = base64.b64decode(data.encode('utf-8'))
-                            else:
-                                continue
-                        else:
-                            continue
-                    except Exception as e:
+                    # audio arrives as raw int16 PCM in binary frames,
+                    # text frames are reserved for control messages
+                    msg = await ws.receive()
+                    if msg["type"] == "websocket.disconnect":
+                        raise WebSocketDisconnect(msg.get("code", 1000))
+
+                    data = msg.get("bytes")
+                    if data is None:
+                        try:
+                            json_data = orjson.loads(msg.get("text") or "")
+                            if "type" in json_data:
+                                if json_data["type"] == "start_client_session":
+                                    self.run_tunnel_client.spawn(modal.Dict())
+                                if json_data["type"] == "set_vad":
+                                    self.use_vad = json_data["vad"]
+                        except Exception as e:
+                            pass
                         continue
 
-                    if self.use_vad:
-                        audio_buffer.append(data)
-                        if len(audio_buffer) > VAD_CHUNK_SIZE:
-                            await audio_queue.put(audio_buffer[:VAD_CHUNK_SIZE])
-                            audio_buffer = audio_buffer[VAD_CHUNK_SIZE:]
+                    if vad:
+                        # silero expects fixed VAD_CHUNK_SIZE sample windows (2 bytes per sample)
+                        audio_buffer.extend(data)
+                        # queue every complete window in one item instead of one item per window
+                        num_bytes = len(audio_buffer) // (VAD_CHUNK_SIZE * 2) * (VAD_CHUNK_SIZE * 2)
+                        if num_bytes:
+                            await audio_queue.put(bytes(audio_buffer[:num_bytes]))
+                            del audio_buffer[:num_bytes]
+                        continue
 
                     await audio_queue.put(data)
                     
@@ -222,79 +292,80 @@ class Transcriber:
 
                     if not vad:
                         start_time = time.perf_counter()                        
-                        transcript = self.transcribe(audio_data)
+                        transcript = await self._queue_transcription(audio_data)
                         await transcription_queue.put(transcript)
 
                         end_time = time.perf_counter()
                         print(f"time taken to transcribe audio segment: {end_time - start_time} seconds")
                     else:
+                        audio_data = audio_data.to("cuda", non_blocking=True)
 
-
-                        # collect in torch array
-                        if all_audio_data is None:
-                            all_audio_data = audio_data
-                        else:
-                            all_audio_data = torch.cat([all_audio_data, audio_data])
+                        # windows arrive batched per message, converted and copied to the GPU once
+                        for window in chunk_audio(audio_data, VAD_CHUNK_SIZE):
+                            # collect in torch array
+                            if all_audio_data is None:
+                                all_audio_data = window
+                            else:
+                                all_audio_data = torch.cat([all_audio_data, window])
                         
-                        start_time = time.perf_counter()
-                        speech_time_stamps =vad(
-                            audio_data, # only need to pass in new data
-                        )
-                        end_time = time.perf_counter()
-                        print(f"time taken to get speech timestamps: {end_time - start_time} seconds")
+                            speech_time_stamps =vad(
+                                window, # only need to pass in new data
+                            )
                         
-                        # no speech detected
-                        if not speech_time_stamps:
-                            continue
+                            # no speech detected
+                            if not speech_time_stamps:
+                                continue
                         
-                        # start of speech detected
-                        if speech_time_stamps.get("start") and start_idx is None:
-                            start_idx = speech_time_stamps["start"]
-                            print(f"speech started at {start_idx}")
+                            # start of speech detected
+                            if speech_time_stamps.get("start") and start_idx is None:
+                                start_idx = speech_time_stamps["start"]
+                                print(f"speech started at {start_idx}")
                         
-                        # end of speech detected
-                        if speech_time_stamps.get("end"):
-                            end_idx = speech_time_stamps["end"]
-                            vad.reset_states()
-
-                            # failback if start of speech not set
-                            if start_idx is None:
-                                start_idx = 0
+                            # end of speech detected
+                            if speech_time_stamps.get("end"):
+                                end_idx = speech_time_stamps["end"]
+                                vad.reset_states()
+
+                                # failback if start of speech not set
+                                if start_idx is None:
+                                    start_idx = 0
                             
-                            # don't transcribe if speech is too short
-                            if end_idx - start_idx < MIN_AUDIO_SEGMENT_DURATION_SAMPLES:
-                                end_idx = None # don't reset start_idx
-                                continue
+                                # don't transcribe if speech is too short
+                                if end_idx - start_idx < MIN_AUDIO_SEGMENT_DURATION_SAMPLES:
+                                    end_idx = None # don't reset start_idx
+                                    continue
                             
-                            start_time = time.perf_counter()
+                                start_time = time.perf_counter()
                             
-                            audio_segment = all_audio_data[start_idx:end_idx]
-                            transcript = self.transcribe(audio_segment)
-                            await transcription_queue.put(transcript)
-
-                            end_time = time.perf_counter()
-                            print(f"time taken to transcribe audio segment: {end_time - start_time} seconds")
-
-                            # feed leftover audio through vad and capture and speech detection
-                            # take largest multiple of VAD_CHUNK_SIZE
-                            samples_remaining = (len(all_audio_data) - end_idx) // VAD_CHUNK_SIZE * VAD_CHUNK_SIZE
-                            all_audio_data = all_audio_data[-samples_remaining:]
-
-                            start_idx = None
-                            end_idx = None
+                                # the micro-batch mixes segments from every session, and non-VAD
+                                # sessions submit cpu tensors, so keep all batch items on one device
+                                audio_segment = all_audio_data[start_idx:end_idx].cpu()
+                                transcript = await self._queue_transcription(audio_segment)
+                                await transcription_queue.put(transcript)
+
+                                end_time = time.perf_counter()
+                                print(f"time taken to transcribe audio segment: {end_time - start_time} seconds")
+
+                                # feed leftover audio through vad and capture and speech detection
+                                # take largest multiple of VAD_CHUNK_SIZE
+                                samples_remaining = (len(all_audio_data) - end_idx) // VAD_CHUNK_SIZE * VAD_CHUNK_SIZE
+                                all_audio_data = all_audio_data[-samples_remaining:]
+
+                                start_idx = None
+                                end_idx = None
                             
-                            # this loop only captures the first start time which will be the
-                            # start of the next segment
-                            for chunk in chunk_audio(all_audio_data, VAD_CHUNK_SIZE):
-                                speech_time_stamps = vad(chunk)
-                                if not speech_time_stamps:
-                                    continue
-                                if speech_time_stamps.get("start") and start_idx is None:
-                                    start_idx = speech_time_stamps["start"]
-                                    print(f"speech started at {start_idx}")
-                                if speech_time_stamps.get("end"):
-                                    print(f"full speech found in remainging audio")
-                                    vad.reset_states()
+                                # this loop only captures the first start time which will be the
+                                # start of the next segment
+                                for chunk in chunk_audio(all_audio_data, VAD_CHUNK_SIZE):
+                                    speech_time_stamps = vad(chunk)
+                                    if not speech_time_stamps:
+                                        continue
+                                    if speech_time_stamps.get("start") and start_idx is None:
+                                        start_idx = speech_time_stamps["start"]
+                                        print(f"speech started at {start_idx}")
+                                    if speech_time_stamps.get("end"):
+                                        print(f"full speech found in remainging audio")
+                                        vad.reset_states()
 
                         
             async def send_loop(transcription_queue, ws):
@@ -318,9 +389,7 @@ class Transcriber:
             except Exception as e:
                 print("Exception:", e)
             finally:
-                if ws and ws.application_state is WebSocketState.CONNECTED:
-                    await ws.close(code=1011) # internal error
-                    ws = None
+                # stop the loops first so send_loop can't write to a closing socket
                 for task in tasks:                    
                     if not task.done():
                         try:
@@ -328,10 +397,37 @@ class Transcriber:
                             await task
                         except asyncio.CancelledError:
                             pass
+                        except Exception as e:
+                            print(f"Error stopping websocket task: {type(e)}: {e}")
+                # a failed send means the client is already gone, don't close it a second time
+                if (
+                    ws
+                    and ws.application_state is WebSocketState.CONNECTED
+                    and ws.client_state is WebSocketState.CONNECTED
+                ):
+                    try:
+                        await ws.close(code=1011) # internal error
+                    except Exception as e:
+                        print(f"Error closing websocket: {type(e)}: {e}")
+                    ws = None
 
 
         def start_server():
-            uvicorn.run(self.web_app, host="0.0.0.0", port=UVICORN_PORT)
+            # the websocket handlers run the VAD and tensor ops on this thread
+            torch.set_grad_enabled(False)
+            uvicorn.run(
+                self.web_app,
+                host="0.0.0.0",
+                port=UVICORN_PORT,
+                loop="uvloop",
+                http="httptools",
+                ws="websockets",
+                ws_max_size=WS_MAX_SIZE,
+                ws_ping_interval=None,
+                # audio is incompressible, skip the deflate copy on every frame
+                ws_per_message_deflate=False,
+                workers=1,
+            )
 
         self.server_thread = threading.Thread(target=start_server, daemon=True)
         self.server_thread.start()
@@ -353,7 +449,12 @@ class Transcriber:
             print("Tunnel client is running. Waiting for it to finish.")
             
             while await d.get.aio("is_running"):
-                await asyncio.sleep(1.0)
+                try:
+                    # returns as soon as the container exits instead of on the next poll
+                    await asyncio.wait_for(self._shutdown.wait(), timeout=1.0)
+                    break
+                except asyncio.TimeoutError:
+                    pass
 
             print("Tunnel client finished.")
 
@@ -361,12 +462,77 @@ class Transcriber:
             print(f"Error running tunnel client: {type(e)}: {e}")
 
     def transcribe(self, audio_data) -> str:
+        return self.transcribe_batch([audio_data])[0]
+
+    def transcribe_batch(self, audio_batch: list) -> list[str]:
+
+        # this runs on a worker thread, so don't swap the process-wide sys.stdout/stderr
+        # to hide nemo's output. verbose=False drops the progress bar and the nemo
+        # logger is already silenced in load()
+        with torch.autocast("cuda", enabled=True, dtype=torch.bfloat16), torch.inference_mode(), torch.no_grad():
+            output = self.model.transcribe(
+                audio_batch,
+                batch_size=len(audio_batch),
+                verbose=False,
+            )
+
+        return [hypothesis.text for hypothesis in output]
+
+    async def _queue_transcription(self, audio_data) -> str:
+        # the session may be on a different loop than the batch worker. cancelling the
+        # wrapped future cancels the submission too, so the worker skips the segment
+        future = asyncio.run_coroutine_threadsafe(
+            self._submit_transcription(audio_data), self._batch_loop
+        )
+        return await asyncio.wrap_future(future)
+
+    async def _submit_transcription(self, audio_data) -> str:
+        future = asyncio.get_running_loop().create_future()
+        await self._batch_queue.put((audio_data, future))
+        return await future
 
-        with NoStdStreams():  # hide output, see https://github.com/NVIDIA/NeMo/discussions/3281#discussioncomment-2251217
-            with torch.autocast("cuda", enabled=True, dtype=torch.bfloat16), torch.inference_mode(), torch.no_grad():
-                output = self.model.transcribe([audio_data])
+    async def _batch_worker(self):
+        """Coalesce segments queued by all websocket sessions into batched transcribe calls."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                item = await asyncio.wait_for(self._batch_queue.get(), GC_IDLE_S)
+            except asyncio.TimeoutError:
+                # nothing queued for a while, collect now instead of between a transcript
+                # being resolved and its session resuming. once per idle period
+                gc.collect()
+                item = await self._batch_queue.get()
+            batch = [item]
+            deadline = loop.time() + TRANSCRIBE_BATCH_WINDOW_S
+            while len(batch) < MAX_TRANSCRIBE_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._batch_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # skip segments whose session was cancelled while waiting
+            batch = [(audio, future) for audio, future in batch if not future.done()]
+            if not batch:
+                continue
 
-        return output[0].text
+            try:
+                transcripts = await asyncio.to_thread(
+                    self.transcribe_batch, [audio for audio, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            if len(batch) > 1:
+                print(f"transcribed batch of {len(batch)} segments")
+            for (_, future), transcript in zip(batch, transcripts):
+                if not future.done():
+                    future.set_result(transcript)
 
     @modal.asgi_app()
     def webapp(self):
@@ -377,28 +543,17 @@ class Transcriber:
         return "pong"
 
     @modal.exit()
-    def exit(self):
-        if self.tunnel_ctx:
-            self.tunnel_ctx.__exit__()
+    async def exit(self):
+        # enter(snap=False) may have failed before creating these, don't mask its error
+        if hasattr(self, "_shutdown"):
+            self._shutdown.set()
+        if getattr(self, "tunnel_ctx", None):
+            await self.tunnel_ctx.__aexit__(None, None, None)
             self.tunnel_ctx = None
             self.tunnel = None
             self.websocket_url = None
 
 
-class NoStdStreams(object):
-    def __init__(self):
-        self.devnull = open(os.devnull, "w")
-
-    def __enter__(self):
-        self._stdout, self._stderr = sys.stdout, sys.stderr
-        self._stdout.flush(), self._stderr.flush()
-        sys.stdout, sys.stderr = self.devnull, self.devnull
-
-    def __exit__(self, exc_type, exc_value, traceback):
-        sys.stdout, sys.stderr = self._stdout, self._stderr
-        self.devnull.close()
-
-
 # warm up snapshots if needed
 if __name__ == "__main__":
     parakeet_stt = modal.Cls.from_name("parakeet-transcription", "Transcriber")
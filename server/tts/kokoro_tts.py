@@ -1,6 +1,7 @@
 import asyncio
+import concurrent.futures
+import itertools
 import time
-import json
 
 import modal
 
@@ -14,15 +15,30 @@ def chunk_audio(audio, desired_frame_size):
 
 image = (
     modal.Image.debian_slim(python_version="3.12")
+    # inductor/triton build their launchers with the system compiler
+    .apt_install("build-essential")
+    # pin a cuda-matched torch wheel instead of whatever kokoro's unpinned dependency resolves to
+    .uv_pip_install(
+        "torch==2.7.1",
+        extra_index_url="https://download.pytorch.org/whl/cu128",
+    )
     .uv_pip_install(
         "kokoro>=0.9.4",
         # "soundfile",
         "fastapi[standard]",
-        "pydub",
         "uvicorn[standard]",
+        "uvloop",
+        "httptools",
+        "orjson",
     )
     .env({
         "HF_HOME": "/cache",
+        # keep compiled and autotuned kernels on the volume so rebuilding the snapshot
+        # doesn't redo the autotuning
+        "TORCHINDUCTOR_CACHE_DIR": "/cache/inductor",
+        "TORCHINDUCTOR_FX_GRAPH_CACHE": "1",
+        "TORCHINDUCTOR_AUTOGRAD_CACHE": "1",
+        "TRITON_CACHE_DIR": "/cache/triton",
     })
 )
 app = modal.App("kokoro-tts")
@@ -31,12 +47,37 @@ with image.imports():
     from kokoro import KPipeline, KModel
     from fastapi import FastAPI, WebSocket, WebSocketDisconnect
     from starlette.websockets import WebSocketState
-    from pydub import AudioSegment
+    import numpy as np
     import threading
+    import orjson
+    import torch
     import uvicorn
 
 DEFAULT_VOICE = 'am_puck'
+# voices the bot speaks with, kept resident on the GPU
+PRELOAD_VOICES = ('am_puck', 'am_fenrir')
 UVICORN_PORT = 8000
+WS_MAX_SIZE = 16 * 1024 * 1024
+SAMPLE_RATE = 24000
+SILENCE_THRESHOLD_DBFS = -50.0
+SILENCE_WINDOW_SAMPLES = SAMPLE_RATE // 100  # 10 ms
+
+
+def _trim_leading_silence(pcm):
+    """Drop the leading silence of an int16 chunk, keeping one silent window as padding.
+
+    Speech starts at the first 10 ms window whose RMS is at or above -50 dBFS.
+    A chunk that never gets there is returned empty.
+    """
+    num_windows = -(-len(pcm) // SILENCE_WINDOW_SAMPLES)
+    starts = np.arange(num_windows) * SILENCE_WINDOW_SAMPLES
+    lengths = np.minimum(SILENCE_WINDOW_SAMPLES, len(pcm) - starts)
+    samples = pcm.astype(np.float32)
+    rms = np.sqrt(np.add.reduceat(samples * samples, starts) / lengths)
+    loud = np.flatnonzero(rms >= 32768 * 10 ** (SILENCE_THRESHOLD_DBFS / 20))
+    if not len(loud):
+        return pcm[:0]
+    return pcm[max(loud[0] - 1, 0) * SILENCE_WINDOW_SAMPLES:]
 
 kokoro_hf_cache = modal.Volume.from_name("kokoro-tts-volume", create_if_missing=True)
 
@@ -60,22 +101,80 @@ class KokoroTTS:
         self.tunnel_ctx = None
         self.tunnel = None
         self.websocket_url = None
+        # set once the server's event loop is up, until then chunks are synthesized inline
+        self._synthesis_loop = None
         
+        torch.set_float32_matmul_precision("high")
+
         self.model = KModel().to("cuda").eval()
-        self.pipeline = KPipeline(model=self.model, lang_code='a', device="cuda")
+        # the istftnet decoder dominates synthesis time. the duration predictor produces
+        # data-dependent lengths, so only the decoder is compiled, with dynamic shapes,
+        # and the warmup below triggers compilation inside the snapshot. autotuning picks
+        # the conv kernels, cuda graphs are skipped since every chunk length would record one
+        self.model.decoder = torch.compile(
+            self.model.decoder, mode="max-autotune-no-cudagraphs", dynamic=True
+        )
+        # run the albert text encoder in bf16 but hand fp32 back to the rest of the
+        # model, the lstm prosody predictor and istft decoder stay in fp32 for fidelity
+        bert_forward = self.model.bert.forward
+
+        def bert_forward_bf16(*args, **kwargs):
+            with torch.autocast("cuda", dtype=torch.bfloat16):
+                return bert_forward(*args, **kwargs).float()
+
+        self.model.bert.forward = bert_forward_bf16
+        # the pipeline only does g2p and chunking, _synthesize_pcm16 runs the model so the
+        # audio stays on the GPU until it has been converted to int16
+        self.pipeline = KPipeline(model=False, lang_code='a')
+        # voice packs are cached on the host and copied to the GPU on every call.
+        # storing them on the GPU makes that copy a no-op per prompt
+        for voice in PRELOAD_VOICES:
+            self.pipeline.voices[voice] = self.pipeline.load_voice(voice).to("cuda")
             
         print("🔥 Warming up the model...")
-        warmup_runs = 6
-        warm_up_prompt = "Hello, we are Moe and Dal, your guides to Modal. We can help you get started with Modal, a platform that lets you run your Python code in the cloud without worrying about the infrastructure. We can walk you through setting up an account, installing the package, and running your first job."
-        for _ in range(warmup_runs):
-            for _ in self._stream_tts(warm_up_prompt):
-                pass
+        warmup_runs = 3
+        warm_up_prompts = [
+            "Hi!",
+            "Sure, happy to help with that.",
+            "Hello, we are Moe and Dal, your guides to Modal. We can help you get started with Modal, a platform that lets you run your Python code in the cloud without worrying about the infrastructure. We can walk you through setting up an account, installing the package, and running your first job.",
+        ]
+        # cover very short and long chunks for every bot voice so the compiled decoder
+        # has its dynamic-shape graphs (and any 0/1 size specializations) before the snapshot
+        for voice in PRELOAD_VOICES:
+            for warm_up_prompt in warm_up_prompts:
+                for _ in range(warmup_runs):
+                    num_chunks = sum(1 for _ in self._stream_tts(warm_up_prompt, voice=voice))
+                    # never snapshot a model that produces no audio
+                    if num_chunks == 0:
+                        raise RuntimeError(
+                            f"Warmup produced no audio for voice {voice}: {warm_up_prompt!r}"
+                        )
         print("✅ Model warmed up!")
 
     @modal.enter(snap=False)
     async def restore(self):
 
+        self._shutdown = asyncio.Event()
         self.webapp = FastAPI()
+        self._synthesis_queue = asyncio.PriorityQueue()
+        self._synthesis_seq = itertools.count()
+        # every chunk runs on this one long-lived thread, which keeps torch's per-thread
+        # cuda state warm instead of hopping between default executor threads
+        self._gpu_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="kokoro-gpu",
+            initializer=torch.cuda.set_device,
+            initargs=(0,),
+        )
+
+        @self.webapp.on_event("startup")
+        async def start_synthesis_worker():
+            # the app is served both by the tunneled uvicorn and by web_endpoint, keep a
+            # single worker. sessions on either loop submit to it from their inference thread
+            if self._synthesis_loop is not None:
+                return
+            self._synthesis_loop = asyncio.get_running_loop()
+            self._synthesis_worker_task = asyncio.create_task(self._synthesis_worker())
 
         @self.webapp.websocket("/ws")
         async def run_with_websocket(ws: WebSocket):
@@ -86,9 +185,12 @@ class KokoroTTS:
 
             async def recv_loop(ws, prompt_queue):
                 while True:
-                    msg = await ws.receive_text()
+                    msg = await ws.receive()
+                    if msg["type"] == "websocket.disconnect":
+                        raise WebSocketDisconnect(msg.get("code", 1000))
                     try:
-                        json_data = json.loads(msg)
+                        # orjson parses binary frames directly, without a utf-8 decode first
+                        json_data = orjson.loads(msg.get("text") or msg.get("bytes") or b"")
                         if "type" in json_data:
                             if json_data["type"] == "prompt":
                                 print(f"Received prompt: {json_data['text']} with voice {json_data['voice']}")
@@ -108,9 +210,30 @@ class KokoroTTS:
                         prompt_msg = await prompt_queue.get()
                         print(f"Received prompt msg: {prompt_msg}")
                         start_time = time.perf_counter()
-                        for chunk in self._stream_tts(prompt_msg['text'], voice=prompt_msg['voice']):
-                            await audio_queue.put(chunk)
-                            print(f"Sending audio data to queue: {len(chunk)} bytes")
+                        # synthesize off the event loop so send_loop streams each chunk as
+                        # soon as it is ready instead of after the whole prompt is done
+                        loop = asyncio.get_running_loop()
+                        # cancelling this task can't stop the producer thread, so it polls
+                        # stop_event and its queued chunk futures are cancelled directly
+                        stop_event = threading.Event()
+                        pending = set()
+
+                        def produce():
+                            for chunk in self._stream_tts(
+                                prompt_msg['text'],
+                                voice=prompt_msg['voice'],
+                                stop_event=stop_event,
+                                pending=pending,
+                            ):
+                                loop.call_soon_threadsafe(audio_queue.put_nowait, chunk)
+
+                        try:
+                            await asyncio.to_thread(produce)
+                        except asyncio.CancelledError:
+                            stop_event.set()
+                            for future in list(pending):
+                                future.cancel()
+                            raise
                         end_time = time.perf_counter()
                         print(f"Time taken to stream TTS: {end_time - start_time:.3f} seconds")
 
@@ -123,7 +246,6 @@ class KokoroTTS:
                     audio = await audio_queue.get()
                     
                     await ws.send_bytes(audio)
-                    print(f"sending audio data: {len(audio)} bytes")
 
             await ws.accept()
 
@@ -140,9 +262,7 @@ class KokoroTTS:
             except Exception as e:
                 print("Exception:", e)
             finally:
-                if ws and ws.application_state is WebSocketState.CONNECTED:
-                    await ws.close(code=1011) # internal error
-                    ws = None
+                # stop the loops first so send_loop can't write to a closing socket
                 for task in tasks:                    
                     if not task.done():
                         try:
@@ -150,11 +270,36 @@ class KokoroTTS:
                             await task
                         except asyncio.CancelledError:
                             pass
+                        except Exception as e:
+                            print(f"Error stopping websocket task: {type(e)}: {e}")
+                # a failed send means the client is already gone, don't close it a second time
+                if (
+                    ws
+                    and ws.application_state is WebSocketState.CONNECTED
+                    and ws.client_state is WebSocketState.CONNECTED
+                ):
+                    try:
+                        await ws.close(code=1011) # internal error
+                    except Exception as e:
+                        print(f"Error closing websocket: {type(e)}: {e}")
+                    ws = None
 
                 
 
         def start_server():
-            uvicorn.run(self.webapp, host="0.0.0.0", port=UVICORN_PORT)
+            uvicorn.run(
+                self.webapp,
+                host="0.0.0.0",
+                port=UVICORN_PORT,
+                loop="uvloop",
+                http="httptools",
+                ws="websockets",
+                ws_max_size=WS_MAX_SIZE,
+                ws_ping_interval=None,
+                # audio is incompressible, skip the deflate copy on every frame
+                ws_per_message_deflate=False,
+                workers=1,
+            )
 
         self.server_thread = threading.Thread(target=start_server, daemon=True)
         self.server_thread.start()
@@ -181,7 +326,12 @@ class KokoroTTS:
             print("Tunnel client is running. Waiting for it to finish.")
 
             while await d.get.aio("is_running"):
-                await asyncio.sleep(1.0)
+                try:
+                    # returns as soon as the container exits instead of on the next poll
+                    await asyncio.wait_for(self._shutdown.wait(), timeout=1.0)
+                    break
+                except asyncio.TimeoutError:
+                    pass
 
             print("Tunnel client finished.")
 
@@ -193,14 +343,19 @@ class KokoroTTS:
         return "pong"
 
     @modal.exit()
-    def exit(self):
-        if self.tunnel_ctx:
-            self.tunnel_ctx.__exit__()
+    async def exit(self):
+        # enter(snap=False) may have failed before creating these, don't mask its error
+        if hasattr(self, "_shutdown"):
+            self._shutdown.set()
+        if hasattr(self, "_gpu_executor"):
+            self._gpu_executor.shutdown(wait=False, cancel_futures=True)
+        if getattr(self, "tunnel_ctx", None):
+            await self.tunnel_ctx.__aexit__(None, None, None)
             self.tunnel_ctx = None
             self.tunnel = None
             self.websocket_url = None
             
-    def _stream_tts(self, prompt: str, voice = None, speed = 1.3):
+    def _stream_tts(self, prompt: str, voice = None, speed = 1.3, stop_event = None, pending = None):
 
         if voice is None:
             voice = DEFAULT_VOICE
@@ -213,50 +368,40 @@ class KokoroTTS:
             # Generate streaming audio from the input text
             print(f"🎤 Starting streaming generation for prompt: {prompt}")
             
-            for (gs, ps, chunk) in self.pipeline(
+            pack = self.pipeline.load_voice(voice).to("cuda")
+            for chunk_index, (gs, ps, _) in enumerate(self.pipeline(
                 prompt, 
                 voice=voice,
                 speed = speed,
-            ):
+            )):
+                if stop_event is not None and stop_event.is_set():
+                    print("🛑 Session closed, stopping generation")
+                    break
+
                 if first_chunk_time is None:
                     print(f"⏱️  Time to first chunk: {(time.perf_counter() - stream_start):.3f} seconds")
-                
-                print(f"gs: {gs}, ps: {ps}, chunk len: {len(chunk)}")
+
                 chunk_count += 1
-                if chunk_count % 10 == 0:  # Log every 10th chunk
-                    print(f"📊 Streamed {chunk_count} chunks so far")
                 
                 try:
                     
-                    # Ensure tensor is on CPU and convert to numpy for efficiency
-                    audio_numpy = chunk.cpu().numpy()
-
-                    audio_numpy = audio_numpy.clip(-1.0, 1.0) * 32767
-                    audio_numpy = audio_numpy.astype('int16')
-
-                    audio_segment = AudioSegment(
-                        audio_numpy.tobytes(),
-                        frame_rate=24000,
-                        sample_width=2,
-                        channels=1
+                    audio_numpy = self._synthesize_chunk(
+                        ps, pack, speed, chunk_index, stop_event=stop_event, pending=pending
                     )
-
-                    def detect_leading_silence(sound, silence_threshold=-50.0, chunk_size=10):
-                        trim_ms = 0  # ms
-                        while sound[trim_ms:trim_ms+chunk_size].dBFS < silence_threshold:
-                            trim_ms += chunk_size
-
-                        return trim_ms - chunk_size # return the index of the last chunk with silence for padding
-
-                    speech_start_idx = detect_leading_silence(audio_segment)
-                    audio_segment = audio_segment[speech_start_idx:]
-                    yield audio_segment.raw_data
+                    audio_numpy = _trim_leading_silence(audio_numpy)
+                    if not len(audio_numpy):
+                        continue
+                    # asgi websocket.send requires bytes, this is the only copy of the samples
+                    yield audio_numpy.tobytes()
                     
+                except concurrent.futures.CancelledError:
+                    break
                 except Exception as e:
                     print(f"❌ Error converting chunk {chunk_count}: {e}")
-                    print(f"   Chunk shape: {chunk.shape if hasattr(chunk, 'shape') else 'N/A'}")
-                    print(f"   Chunk type: {type(chunk)}")
-                    continue  # Skip this chunk and continue
+                    print(f"   Phonemes: {ps}")
+                    # a model failure isn't specific to this chunk, skipping it would
+                    # only hide a broken decoder behind silent sessions
+                    raise
             
             final_time = time.time()
             print(f"⏱️  Total streaming time: {final_time - stream_start:.3f} seconds")
@@ -268,6 +413,72 @@ class KokoroTTS:
             print(f"❌ Error creating stream generator: {e}")
             raise
 
+    def _synthesize_chunk(
+        self, phonemes: str, pack, speed: float, chunk_index: int, stop_event = None, pending = None
+    ):
+        """Synthesize one chunk, going through the shared scheduler once the server is up.
+
+        The submitted future is tracked in pending so a closing session can cancel it,
+        which lets the worker skip the chunk instead of running it for nobody.
+        """
+        if self._synthesis_loop is None:
+            return self._synthesize_pcm16(phonemes, pack, speed)
+        future = asyncio.run_coroutine_threadsafe(
+            self._queue_synthesis(phonemes, pack, speed, chunk_index),
+            self._synthesis_loop,
+        )
+        if pending is not None:
+            pending.add(future)
+        try:
+            # the session may have closed before the future was registered
+            if stop_event is not None and stop_event.is_set():
+                future.cancel()
+            return future.result()
+        finally:
+            if pending is not None:
+                pending.discard(future)
+
+    async def _queue_synthesis(self, phonemes: str, pack, speed: float, chunk_index: int):
+        future = asyncio.get_running_loop().create_future()
+        await self._synthesis_queue.put(
+            (chunk_index, next(self._synthesis_seq), phonemes, pack, speed, future)
+        )
+        return await future
+
+    async def _synthesis_worker(self):
+        """Run chunks queued by all websocket sessions on the GPU one at a time.
+
+        Chunks are ordered by their index within their prompt, so the first chunk
+        of a new prompt goes ahead of later chunks of prompts already streaming.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, phonemes, pack, speed, future = await self._synthesis_queue.get()
+            if future.done():
+                continue
+            try:
+                pcm = await loop.run_in_executor(
+                    self._gpu_executor, self._synthesize_pcm16, phonemes, pack, speed
+                )
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(pcm)
+
+    def _synthesize_pcm16(self, phonemes: str, pack, speed: float):
+        """Run Kokoro on one phoneme chunk and return int16 PCM as a numpy array.
+
+        Mirrors KModel.forward, but scales and casts on the GPU so only the
+        int16 samples are copied back to the host.
+        """
+        input_ids = [0, *(self.model.vocab[p] for p in phonemes if p in self.model.vocab), 0]
+        input_ids = torch.tensor([input_ids], dtype=torch.long, device="cuda")
+        audio, _ = self.model.forward_with_tokens(input_ids, pack[len(phonemes) - 1], speed)
+        pcm = (audio.clamp(-1.0, 1.0) * 32767).to(torch.int16)
+        return pcm.cpu().numpy()
+
 
 def get_kokoro_server_url():
     try: